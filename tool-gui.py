@@ -9,10 +9,23 @@ import json
 import argparse
 import cv2
 import warnings
+import concurrent.futures
+import threading
+import time
 
 dist = 0.002
 deg = 1
 
+# audit thresholds
+audit_depth_tol = 0.01  # max |object depth - measured depth| in meter for a pixel to count as fitting
+audit_rot_tol = 1e-3  # max deviation of R * R^T from identity
+audit_min_inlier_ratio = 0.5  # objects with less fitting pixels are reported as depth misfit
+audit_max_free_space_ratio = 0.25  # objects with more pixels in front of the measured depth are reported as floating
+
+pick_max_snap_dist = 0.01  # click to place: max distance in meter between ray hit and the scene point used
+
+refine_min_fitness = 0.3  # "Accept good" of refine all keeps results with at least this fitness (see refine_objects)
+
 
 class Dataset:
     def __init__(self, dataset_path, dataset_split):
@@ -20,6 +33,210 @@ class Dataset:
         self.objects_path = os.path.join(dataset_path, 'models')
 
 
+def load_model_names(objects_path):
+    path = objects_path + '/models_names.json'
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+            model_names = [data[x]['name'] for x in data]
+    else:  # model names file doesn't exist
+        warnings.warn(
+            "models_names.json doesn't exist. Objects will be loaded with their literal id (obj_000001, obj_000002, ...)")
+        no_of_models = len([os.path.basename(x)[:-4] for x in glob.glob(objects_path + '/*.ply')])
+        model_names = ['obj_' + f'{i + 1:06}' for i in range(no_of_models)]
+
+    return model_names
+
+
+def load_model_points(objects_path, obj_id):
+    obj_geometry = o3d.io.read_point_cloud(os.path.join(objects_path, 'obj_' + f"{int(obj_id):06}" + '.ply'))
+    obj_geometry.points = o3d.utility.Vector3dVector(
+        np.array(obj_geometry.points) / 1000)  # convert mm to meter
+    return obj_geometry
+
+
+def load_depth_image(scenes_path, scene_num, image_num):
+    depth_path = os.path.join(scenes_path, f'{scene_num:06}', 'depth', f'{image_num:06}' + '.png')
+    depth_img = cv2.imread(depth_path, -1)
+    return np.float32(depth_img / 1000)
+
+
+def load_scene_images(scenes_path, scene_num, image_num):
+    scene_path = os.path.join(scenes_path, f'{scene_num:06}')
+    rgb_path = os.path.join(scene_path, 'rgb', f'{image_num:06}' + '.png')
+    rgb_img = cv2.imread(rgb_path)
+    depth_img = load_depth_image(scenes_path, scene_num, image_num)
+
+    camera_params_path = os.path.join(scene_path, 'scene_camera.json')
+    with open(camera_params_path) as f:
+        data = json.load(f)
+        cam_K = data[str(image_num)]['cam_K']
+        cam_K = np.array(cam_K).reshape((3, 3))
+
+    return rgb_img, depth_img, cam_K
+
+
+def pose_to_transform(obj):
+    translation = np.array(np.array(obj['cam_t_m2c']), dtype=np.float64) / 1000  # convert to meter
+    orientation = np.array(np.array(obj['cam_R_m2c']), dtype=np.float64)
+    transform = np.concatenate((orientation.reshape((3, 3)), translation.reshape(3, 1)), axis=1)
+    transform_cam_to_obj = np.concatenate(
+        (transform, np.array([0, 0, 0, 1]).reshape(1, 4)))  # homogeneous transform
+    return transform_cam_to_obj
+
+
+def cast_ray_to_depth(origin, direction, depth_img, cam_K, t_max, steps=1024, tol=0.005):
+    """Return the first point along the ray that reaches the surface of the depth image (camera frame), or None.
+
+    Only samples within one step or tol behind the measured depth count as hits, the unobserved space behind
+    foreground objects (occlusion shadow) is marched through.
+    """
+    t = np.linspace(0, t_max, steps)
+    samples = origin + t.reshape(-1, 1) * direction
+    in_front = samples[:, 2] > 0
+    uv = np.matmul(samples, cam_K.T)
+    u = np.round(uv[:, 0] / np.where(in_front, uv[:, 2], 1)).astype(np.int64)
+    v = np.round(uv[:, 1] / np.where(in_front, uv[:, 2], 1)).astype(np.int64)
+    h, w = depth_img.shape
+    inside = in_front & (u >= 0) & (u < w) & (v >= 0) & (v < h)
+    measured = np.zeros(steps)
+    measured[inside] = depth_img[v[inside], u[inside]]
+    behind = samples[:, 2] - measured
+    max_behind = max(t_max / (steps - 1) * abs(direction[2]), tol)
+    hits = np.flatnonzero(inside & (measured > 0) & (behind >= 0) & (behind <= max_behind))
+    if not hits.size:
+        return None
+    return samples[hits[0]]
+
+
+def rotation_between(a, b):
+    """Smallest rotation matrix turning unit vector a onto unit vector b."""
+    v = np.cross(a, b)
+    c = np.dot(a, b)
+    if np.linalg.norm(v) < 1e-8:
+        if c > 0:
+            return np.identity(3)
+        # opposite vectors: rotate 180 deg around any axis perpendicular to a
+        axis = np.cross(a, [1, 0, 0]) if abs(a[0]) < 0.9 else np.cross(a, [0, 1, 0])
+        axis /= np.linalg.norm(axis)
+        return 2 * np.outer(axis, axis) - np.identity(3)
+    v_x = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]])
+    return np.identity(3) + v_x + np.matmul(v_x, v_x) / (1 + c)
+
+
+def load_models_info(objects_path):
+    path = os.path.join(objects_path, 'models_info.json')
+    if not os.path.exists(path):
+        return dict()
+    with open(path) as f:
+        return {int(obj_id): info for obj_id, info in json.load(f).items()}
+
+
+def remove_symmetry_twist(delta, symmetries_continuous):
+    """Remove the rotation around continuous symmetry axes from a pose change given in the model frame."""
+    for symmetry in symmetries_continuous:
+        axis = np.array(symmetry['axis'], dtype=np.float64)
+        axis /= np.linalg.norm(axis)
+        offset = np.array(symmetry['offset'], dtype=np.float64) / 1000  # convert mm to meter
+        # swing-twist decomposition: the swing is the smallest rotation moving the axis like delta does
+        R = delta[0:3, 0:3]
+        swing = rotation_between(axis, np.matmul(R, axis))
+        twist = np.matmul(swing.T, R)
+        twist_inv = np.identity(4)  # inverse twist around the axis through offset
+        twist_inv[0:3, 0:3] = twist.T
+        twist_inv[0:3, 3] = offset - np.matmul(twist.T, offset)
+        delta = np.matmul(delta, twist_inv)
+    return delta
+
+
+def closest_symmetric_pose(transform, reference, symmetries_discrete):
+    """Return the pose equivalent to transform under the discrete symmetries that is closest in rotation to reference."""
+    candidates = [transform]
+    for symmetry in symmetries_discrete:
+        symmetry = np.array(symmetry, dtype=np.float64).reshape((4, 4))
+        symmetry[0:3, 3] /= 1000  # convert mm to meter
+        candidates.append(np.matmul(transform, symmetry))
+    traces = [np.trace(np.matmul(reference[0:3, 0:3].T, candidate[0:3, 0:3])) for candidate in candidates]
+    return candidates[int(np.argmax(traces))]  # largest trace is the smallest rotation angle
+
+
+def refine_objects(target, objects, objects_info, threshold=0.004, rounds=3):
+    """Refine all objects against the scene together with ICP.
+
+    Every scene point is used as correspondence only by the object closest to it, so touching objects do not pull
+    each other. objects_info holds the models_info.json entry of every object for its symmetries. Returns per object
+    the refined transform, fitness and ICP inlier rmse. The fitness is the fraction of model points visible from the
+    camera that have a scene point of the object within threshold, so the hidden back of the model does not count.
+    """
+    radius = 0.002
+    target = o3d.geometry.PointCloud(target)
+    sources = [o3d.geometry.PointCloud(obj.obj_geometry) for obj in objects]
+
+    # only scene points close to any object take part in the refinement
+    bounds = sources[0].get_axis_aligned_bounding_box()
+    for source in sources[1:]:
+        bounds += source.get_axis_aligned_bounding_box()
+    bounds = o3d.geometry.AxisAlignedBoundingBox(bounds.get_min_bound() - 4 * threshold,
+                                                 bounds.get_max_bound() + 4 * threshold)
+    target = target.crop(bounds)
+    target.estimate_normals(o3d.geometry.KDTreeSearchParamHybrid(radius=radius * 2, max_nn=30))
+    for source in sources:
+        source.estimate_normals(o3d.geometry.KDTreeSearchParamHybrid(radius=radius * 2, max_nn=30))
+
+    transforms = [obj.transform.copy() for obj in objects]
+    fitness = [0.0] * len(objects)
+    inlier_rmse = [0.0] * len(objects)
+
+    def refine(i, target_points):
+        if len(target_points.points) < 3:
+            return np.identity(4), 0.0, 0.0
+        reg = o3d.pipelines.registration.registration_icp(
+            sources[i], target_points, threshold, np.identity(4),
+            o3d.pipelines.registration.TransformationEstimationPointToPlane(),
+            o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=50))
+        # remove motion along continuous symmetries, it is not observable and only makes the pose drift
+        symmetries_continuous = objects_info[i].get('symmetries_continuous', [])
+        if symmetries_continuous:
+            delta = np.matmul(np.linalg.inv(transforms[i]), np.matmul(reg.transformation, transforms[i]))
+            delta = remove_symmetry_twist(delta, symmetries_continuous)
+            return np.matmul(transforms[i], np.matmul(delta, np.linalg.inv(transforms[i]))), reg.fitness, \
+                reg.inlier_rmse
+        return reg.transformation, reg.fitness, reg.inlier_rmse
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        for _ in range(rounds):
+            # exclusive correspondences: each scene point belongs to the closest object only
+            distances = np.stack([np.asarray(target.compute_point_cloud_distance(source)) for source in sources])
+            owner = np.argmin(distances, axis=0)
+            owned = distances[owner, np.arange(owner.size)] < 2 * threshold
+            targets = [target.select_by_index(np.flatnonzero(owned & (owner == i))) for i in range(len(objects))]
+
+            results = list(executor.map(refine, range(len(objects)), targets))
+            for i, (h_transform, obj_fitness, obj_inlier_rmse) in enumerate(results):
+                sources[i].transform(h_transform)
+                transforms[i] = np.matmul(h_transform, transforms[i])
+                fitness[i] = obj_fitness
+                inlier_rmse[i] = obj_inlier_rmse
+
+    # fitness over the model points facing the camera (at the origin), the back side can never match
+    for i, source in enumerate(sources):
+        try:
+            radius = np.linalg.norm(np.asarray(source.points), axis=1).max() * 100
+            _, visible = source.hidden_point_removal(np.zeros(3), radius)
+            visible = source.select_by_index(visible)
+            distances = np.asarray(visible.compute_point_cloud_distance(targets[i]))
+            fitness[i] = float(np.mean(distances < threshold)) if len(targets[i].points) and distances.size else 0.0
+        except RuntimeError:  # too few points for the visibility hull, keep the ICP fitness
+            pass
+
+    for i, obj in enumerate(objects):
+        symmetries_discrete = objects_info[i].get('symmetries_discrete', [])
+        transforms[i] = closest_symmetric_pose(transforms[i], obj.transform, symmetries_discrete)
+
+    return [{"transform": transforms[i], "fitness": fitness[i], "inlier_rmse": inlier_rmse[i]}
+            for i in range(len(objects))]
+
+
 class AnnotationScene:
     def __init__(self, scene_point_cloud, scene_num, image_num):
         self.annotation_scene = scene_point_cloud
@@ -28,8 +245,8 @@ class AnnotationScene:
 
         self.obj_list = list()
 
-    def add_obj(self, obj_geometry, obj_name, obj_instance, transform=np.identity(4)):
-        self.obj_list.append(self.SceneObject(obj_geometry, obj_name, obj_instance, transform))
+    def add_obj(self, obj_geometry, obj_name, obj_instance, transform=np.identity(4), obj_id=None):
+        self.obj_list.append(self.SceneObject(obj_geometry, obj_name, obj_instance, transform, obj_id))
 
     def get_objects(self):
         return self.obj_list[:]
@@ -38,11 +255,12 @@ class AnnotationScene:
         self.obj_list.pop(index)
 
     class SceneObject:
-        def __init__(self, obj_geometry, obj_name, obj_instance, transform):
+        def __init__(self, obj_geometry, obj_name, obj_instance, transform, obj_id=None):
             self.obj_geometry = obj_geometry
             self.obj_name = obj_name
             self.obj_instance = obj_instance
             self.transform = transform
+            self.obj_id = obj_id  # BOP object id (1-based index into the model list)
 
 
 class Settings:
@@ -217,9 +435,12 @@ class AppWindow:
         self._settings_panel.add_child(self._scene_control)
         refine_position = gui.Button("Refine position")
         refine_position.set_on_clicked(self._on_refine)
+        refine_all = gui.Button("Refine all")
+        refine_all.set_on_clicked(self._on_refine_all)
         generate_save_annotation = gui.Button("generate annotation - save/update")
         generate_save_annotation.set_on_clicked(self._on_generate)
         self._scene_control.add_child(refine_position)
+        self._scene_control.add_child(refine_all)
         self._scene_control.add_child(generate_save_annotation)
 
         # ---- Menu ----
@@ -250,8 +471,21 @@ class AppWindow:
 
         # set callbacks for key control
         self._scene.set_on_key(self._transform)
+        # ctrl + left click/drag places the selected object on the scene surface
+        self._scene.set_on_mouse(self._on_mouse)
 
         self._left_shift_modifier = False
+        self._pick_kdtree = None
+
+        # state of the loads running in worker threads
+        self._scene_load_id = 0
+        self._scene_loading = False
+        self._models_loading = False
+        self._model_names = None
+        self._refine_all_running = False
+
+        # models_info.json, loaded on first use by refine all
+        self._models_info = None
 
     def _update_scene_numbers(self):
         self._scene_number.text = "Scene: " + f'{self._annotation_scene.scene_num:06}'
@@ -356,6 +590,63 @@ class AppWindow:
 
         return gui.Widget.EventCallbackResult.HANDLED
 
+    def _on_mouse(self, event):
+        if event.type not in (gui.MouseEvent.Type.BUTTON_DOWN, gui.MouseEvent.Type.DRAG) or \
+                not event.is_modifier_down(gui.KeyModifier.CTRL) or not event.is_button_down(gui.MouseButton.LEFT):
+            return gui.Widget.EventCallbackResult.IGNORED
+
+        if self._pick_kdtree is None:
+            return gui.Widget.EventCallbackResult.CONSUMED
+        # if no active_mesh selected print error
+        if self._meshes_used.selected_index == -1:
+            if event.type == gui.MouseEvent.Type.BUTTON_DOWN:
+                self._on_error("No objects are highlighted in scene meshes")
+            return gui.Widget.EventCallbackResult.CONSUMED
+
+        # ray through the clicked pixel from the view camera
+        frame = self._scene.frame
+        x = event.x - frame.x
+        y = event.y - frame.y
+        camera = self._scene.scene.camera
+        near = np.asarray(camera.unproject(x, y, 0, frame.width, frame.height), dtype=np.float64)
+        far = np.asarray(camera.unproject(x, y, 1, frame.width, frame.height), dtype=np.float64)
+        direction = (far - near) / np.linalg.norm(far - near)
+
+        hit = cast_ray_to_depth(near, direction, self._pick_depth, self._pick_cam_K, self._pick_max_dist)
+        if hit is None:
+            return gui.Widget.EventCallbackResult.CONSUMED
+        [_, idx, dist2] = self._pick_kdtree.search_knn_vector_3d(hit, 1)
+        if dist2[0] > pick_max_snap_dist ** 2:  # no scene point where the ray meets the depth surface
+            return gui.Widget.EventCallbackResult.CONSUMED
+        point = np.asarray(self._annotation_scene.annotation_scene.points)[idx[0]]
+        normal = np.asarray(self._annotation_scene.annotation_scene.normals)[idx[0]]
+        if np.dot(normal, point) > 0:  # orient normal towards the depth camera
+            normal = -normal
+
+        objects = self._annotation_scene.get_objects()
+        self._place_obj(objects[self._meshes_used.selected_index], point, normal)
+        return gui.Widget.EventCallbackResult.CONSUMED
+
+    def _place_obj(self, active_obj, point, normal):
+        self._annotation_changed = True
+
+        # align object z axis with the surface normal and rest its lowest point on the surface
+        center = active_obj.obj_geometry.get_center()
+        R = rotation_between(active_obj.transform[0:3, 2], normal)
+        points = np.matmul(np.asarray(active_obj.obj_geometry.points) - center, R.T)
+        new_center = point - normal * np.dot(points, normal).min()
+        T_neg = np.vstack((np.hstack((np.identity(3), -center.reshape(3, 1))), [0, 0, 0, 1]))
+        R = np.vstack((np.hstack((R, [[0], [0], [0]])), [0, 0, 0, 1]))
+        T_pos = np.vstack((np.hstack((np.identity(3), new_center.reshape(3, 1))), [0, 0, 0, 1]))
+        h_transform = np.matmul(T_pos, np.matmul(R, T_neg))
+
+        active_obj.obj_geometry.transform(h_transform)
+        self._scene.scene.remove_geometry(active_obj.obj_name)
+        self._scene.scene.add_geometry(active_obj.obj_name, active_obj.obj_geometry,
+                                       self.settings.annotation_obj_material,
+                                       add_downsampled_copy_for_fast_rendering=True)
+        active_obj.transform = np.matmul(h_transform, active_obj.transform)
+
     def _on_refine(self):
         self._annotation_changed = True
 
@@ -387,7 +678,106 @@ class AppWindow:
                                        add_downsampled_copy_for_fast_rendering=True)
         active_obj.transform = np.matmul(reg.transformation, active_obj.transform)
 
+    def _on_refine_all(self):
+        if self._scene_loading:
+            self._on_error("Annotations of the scene are still loading.")
+            return
+        if self._refine_all_running:
+            self._on_error("Refine all is still running.")
+            return
+
+        objects = self._annotation_scene.get_objects()
+        if not objects:
+            self._on_error("There are no objects in the scene to refine.")
+            return
+
+        if self._models_info is None:
+            self._models_info = load_models_info(self.scenes.objects_path)
+        objects_info = [self._models_info.get(obj.obj_id, {}) for obj in objects]
+
+        # the worker thread only gets copies, the user can keep working on the scene meanwhile
+        target = o3d.geometry.PointCloud(self._annotation_scene.annotation_scene)
+        snapshots = [AnnotationScene.SceneObject(o3d.geometry.PointCloud(obj.obj_geometry), obj.obj_name,
+                                                 obj.obj_instance, obj.transform.copy(), obj.obj_id)
+                     for obj in objects]
+        load_id = self._scene_load_id
+        self._refine_all_running = True
+
+        def refine():
+            results = None
+            try:
+                results = refine_objects(target, snapshots, objects_info)
+            except Exception as e:
+                print(e)
+
+            def update():
+                self._refine_all_running = False
+                if load_id != self._scene_load_id or results is None:  # another scene was opened meanwhile
+                    return
+                self._show_refine_all_results(objects, snapshots, results)
+
+            gui.Application.instance.post_to_main_thread(self.window, update)
+
+        threading.Thread(target=refine, daemon=True).start()
+
+    def _show_refine_all_results(self, objects, snapshots, results):
+        for obj, result in zip(objects, results):
+            print(f"[Info] Refined {obj.obj_name}: fitness {result['fitness']:.3f}, "
+                  f"inlier rmse {result['inlier_rmse'] * 1000:.2f} mm")
+
+        # let the user accept or reject the results in bulk
+        em = self.window.theme.font_size
+        dlg = gui.Dialog("Refine all")
+        dlg_layout = gui.Vert(em, gui.Margins(em, em, em, em))
+        grid = gui.VGrid(3, 0.25 * em)
+        for label in ["Object", "Fitness", "RMSE [mm]"]:
+            grid.add_child(gui.Label(label))
+        for obj, result in zip(objects, results):
+            grid.add_child(gui.Label(obj.obj_name))
+            grid.add_child(gui.Label(f"{result['fitness']:.3f}"))
+            grid.add_child(gui.Label(f"{result['inlier_rmse'] * 1000:.2f}"))
+        dlg_layout.add_child(grid)
+
+        accept_all = gui.Button("Accept all")
+        accept_all.set_on_clicked(lambda: self._on_refine_all_accept(objects, snapshots, results, 0))
+        accept_good = gui.Button(f"Accept fitness >= {refine_min_fitness}")
+        accept_good.set_on_clicked(
+            lambda: self._on_refine_all_accept(objects, snapshots, results, refine_min_fitness))
+        reject = gui.Button("Reject all")
+        reject.set_on_clicked(self._on_about_ok)
+
+        h = gui.Horiz(0.25 * em)
+        h.add_stretch()
+        h.add_child(accept_all)
+        h.add_child(accept_good)
+        h.add_child(reject)
+        h.add_stretch()
+        dlg_layout.add_child(h)
+
+        dlg.add_child(dlg_layout)
+        self.window.show_dialog(dlg)
+
+    def _on_refine_all_accept(self, objects, snapshots, results, min_fitness):
+        self.window.close_dialog()
+        for obj, snapshot, result in zip(objects, snapshots, results):
+            if result['fitness'] < min_fitness or obj not in self._annotation_scene.get_objects():
+                continue
+            if not np.array_equal(obj.transform, snapshot.transform):
+                print(f"[Info] {obj.obj_name} was moved while refining, refine result is not applied")
+                continue
+            self._annotation_changed = True
+            h_transform = np.matmul(result['transform'], np.linalg.inv(obj.transform))
+            obj.obj_geometry.transform(h_transform)
+            self._scene.scene.remove_geometry(obj.obj_name)
+            self._scene.scene.add_geometry(obj.obj_name, obj.obj_geometry, self.settings.annotation_obj_material,
+                                           add_downsampled_copy_for_fast_rendering=True)
+            obj.transform = result['transform']
+
     def _on_generate(self):
+        if self._scene_loading:
+            self._on_error("Annotations of the scene are still loading.")
+            return
+
         image_num = self._annotation_scene.image_num
         model_names = self.load_model_names()
 
@@ -508,6 +898,13 @@ class AppWindow:
         return count
 
     def _add_mesh(self):
+        if self._scene_loading:
+            self._on_error("Annotations of the scene are still loading.")
+            return
+        if self._models_loading or self._meshes_available.selected_index == -1:
+            self._on_error("No object is selected in the model list.")
+            return
+
         meshes = self._annotation_scene.get_objects()
         meshes = [i.obj_name for i in meshes]
 
@@ -524,7 +921,8 @@ class AppWindow:
         new_mesh_name = str(self._meshes_available.selected_value) + '_' + str(new_mesh_instance)
         self._scene.scene.add_geometry(new_mesh_name, object_geometry, self.settings.annotation_obj_material,
                                        add_downsampled_copy_for_fast_rendering=True)
-        self._annotation_scene.add_obj(object_geometry, new_mesh_name, new_mesh_instance, transform=init_trans)
+        self._annotation_scene.add_obj(object_geometry, new_mesh_name, new_mesh_instance, transform=init_trans,
+                                       obj_id=self._meshes_available.selected_index + 1)
         meshes = self._annotation_scene.get_objects()  # update list after adding current object
         meshes = [i.obj_name for i in meshes]
         self._meshes_used.set_items(meshes)
@@ -561,20 +959,12 @@ class AppWindow:
         self._annotation_changed = False
 
         self._scene.scene.clear_geometry()
+        self._pick_kdtree = None
+        self._scene_loading = False  # set again once the new load is started
+        self._scene_load_id += 1  # results of loads still running for a previous scene are dropped
         geometry = None
 
-        scene_path = os.path.join(scenes_path, f'{scene_num:06}')
-        rgb_path = os.path.join(scene_path, 'rgb', f'{image_num:06}' + '.png')
-        rgb_img = cv2.imread(rgb_path)
-        depth_path = os.path.join(scene_path, 'depth', f'{image_num:06}' + '.png')
-        depth_img = cv2.imread(depth_path, -1)
-        depth_img = np.float32(depth_img / 1000)
-
-        camera_params_path = os.path.join(scene_path, 'scene_camera.json')
-        with open(camera_params_path) as f:
-            data = json.load(f)
-            cam_K = data[str(image_num)]['cam_K']
-            cam_K = np.array(cam_K).reshape((3, 3))
+        rgb_img, depth_img, cam_K = load_scene_images(scenes_path, scene_num, image_num)
 
         try:
             geometry = self._make_point_cloud(rgb_img, depth_img, cam_K)
@@ -583,13 +973,11 @@ class AppWindow:
 
         if geometry is not None:
             print("[Info] Successfully read scene ", scene_num)
-            if not geometry.has_normals():
-                geometry.estimate_normals()
-            geometry.normalize_normals()
         else:
             print("[WARNING] Failed to read points")
 
         try:
+            # show the back-projected scene first, normals and annotated objects follow from a worker thread
             self._scene.scene.add_geometry("annotation_scene", geometry, self.settings.scene_material,
                                            add_downsampled_copy_for_fast_rendering=True)
             bounds = geometry.get_axis_aligned_bounding_box()
@@ -602,64 +990,111 @@ class AppWindow:
             self._annotation_scene = AnnotationScene(geometry, scene_num, image_num)
             self._meshes_used.set_items([])  # clear list from last loaded scene
 
-            # load values if an annotation already exists
+            self._scene_loading = True
+            threading.Thread(target=self._scene_load_objects,
+                             args=(self._scene_load_id, scene_num, image_num, o3d.geometry.PointCloud(geometry),
+                                   depth_img, cam_K, np.linalg.norm(bounds.get_max_bound()) * 2),
+                             daemon=True).start()
+
+        except Exception as e:
+            print(e)
+
+        self._update_scene_numbers()
+
+    def _scene_load_objects(self, load_id, scene_num, image_num, geometry, depth_img, cam_K, max_dist):
+        # runs in a worker thread, the gui is only touched from the posted update below
+        kdtree = None
+        loaded_objects = list()
+
+        def update():
+            if load_id != self._scene_load_id:  # another scene was opened meanwhile
+                return
+            if kdtree is not None:
+                self._annotation_scene.annotation_scene.normals = geometry.normals
+
+                # lookup structures for click to place, built once per scene
+                self._pick_depth = depth_img
+                self._pick_cam_K = cam_K
+                self._pick_kdtree = kdtree
+                self._pick_max_dist = max_dist
+
+            for obj_geometry, obj_name, obj_instance, transform_cam_to_obj, obj_id in loaded_objects:
+                # add object to annotation_scene object and to the scene
+                self._annotation_scene.add_obj(obj_geometry, obj_name, obj_instance, transform_cam_to_obj, obj_id)
+                self._scene.scene.add_geometry(obj_name, obj_geometry, self.settings.annotation_obj_material,
+                                               add_downsampled_copy_for_fast_rendering=True)
+            self._meshes_used.set_items([obj.obj_name for obj in self._annotation_scene.get_objects()])
+            self._scene_loading = False
+
+        try:
+            if not geometry.has_normals():
+                geometry.estimate_normals()
+            geometry.normalize_normals()
+            kdtree = o3d.geometry.KDTreeFlann(geometry)
 
+            # load values if an annotation already exists
             model_names = self.load_model_names()
 
-            scene_gt_path = os.path.join(self.scenes.scenes_path, f"{self._annotation_scene.scene_num:06}",
-                                         'scene_gt.json')
-            # if os.path.exists(json_path):
+            scene_gt_path = os.path.join(self.scenes.scenes_path, f"{scene_num:06}", 'scene_gt.json')
             with open(scene_gt_path) as scene_gt_file:
                 data = json.load(scene_gt_file)
                 scene_data = data[str(image_num)]
                 active_meshes = list()
                 for obj in scene_data:
-                    # add object to annotation_scene object
-                    obj_geometry = o3d.io.read_point_cloud(
-                        os.path.join(self.scenes.objects_path, 'obj_' + f"{int(obj['obj_id']):06}" + '.ply'))
-                    obj_geometry.points = o3d.utility.Vector3dVector(
-                        np.array(obj_geometry.points) / 1000)  # convert mm to meter
+                    obj_geometry = load_model_points(self.scenes.objects_path, obj['obj_id'])
                     model_name = model_names[int(obj['obj_id']) - 1]
                     obj_instance = self._obj_instance_count(model_name, active_meshes)
                     obj_name = model_name + '_' + str(obj_instance)
-                    translation = np.array(np.array(obj['cam_t_m2c']), dtype=np.float64) / 1000  # convert to meter
-                    orientation = np.array(np.array(obj['cam_R_m2c']), dtype=np.float64)
-                    transform = np.concatenate((orientation.reshape((3, 3)), translation.reshape(3, 1)), axis=1)
-                    transform_cam_to_obj = np.concatenate(
-                        (transform, np.array([0, 0, 0, 1]).reshape(1, 4)))  # homogeneous transform
-
-                    self._annotation_scene.add_obj(obj_geometry, obj_name, obj_instance, transform_cam_to_obj)
-                    # adding object to the scene
+                    transform_cam_to_obj = pose_to_transform(obj)
+
                     obj_geometry.translate(transform_cam_to_obj[0:3, 3])
                     center = obj_geometry.get_center()
                     obj_geometry.rotate(transform_cam_to_obj[0:3, 0:3], center=center)
-                    self._scene.scene.add_geometry(obj_name, obj_geometry, self.settings.annotation_obj_material,
-                                                   add_downsampled_copy_for_fast_rendering=True)
+                    loaded_objects.append((obj_geometry, obj_name, obj_instance, transform_cam_to_obj,
+                                           int(obj['obj_id'])))
                     active_meshes.append(obj_name)
-            self._meshes_used.set_items(active_meshes)
-
         except Exception as e:
             print(e)
-
-        self._update_scene_numbers()
+        finally:  # always hand back, otherwise the scene stays marked as loading
+            gui.Application.instance.post_to_main_thread(self.window, update)
 
     def update_obj_list(self):
-        model_names = self.load_model_names()
-        self._meshes_available.set_items(model_names)
+        self._models_loading = True
+
+        def load():
+            model_names = list()
+            try:
+                model_names = self.load_model_names()
+            except Exception as e:
+                print(e)
+            finally:
+                def update():
+                    self._meshes_available.set_items(model_names)
+                    self._models_loading = False
+
+                gui.Application.instance.post_to_main_thread(self.window, update)
+
+        threading.Thread(target=load, daemon=True).start()
 
     def load_model_names(self):
-        path = self.scenes.objects_path + '/models_names.json'
-        if os.path.exists(path):
-            with open(path) as f:
-                data = json.load(f)
-                model_names = [data[x]['name'] for x in data]
-        else:  # model names file doesn't exist
-            warnings.warn(
-                "models_names.json doesn't exist. Objects will be loaded with their literal id (obj_000001, obj_000002, ...)")
-            no_of_models = len([os.path.basename(x)[:-4] for x in glob.glob(self.scenes.objects_path + '/*.ply')])
-            model_names = ['obj_' + f'{i + 1:06}' for i in range(no_of_models)]
-
-        return model_names
+        if self._model_names is None:  # models directory is only scanned once
+            self._model_names = load_model_names(self.scenes.objects_path)
+        return self._model_names
+
+    def run_benchmark_startup(self, start_time):
+        # drive the event loop ourselves to take the time right after the first frame was drawn
+        app = gui.Application.instance
+        first_frame = None
+        while app.run_one_tick():
+            now = time.perf_counter()
+            if first_frame is None:
+                first_frame = now - start_time
+                print(f"[Benchmark] time to first frame (approx., end of first event loop tick incl. its draw, "
+                      f"GPU completion not awaited): {first_frame:.3f} s")
+            if not self._scene_loading and not self._models_loading:
+                print(f"[Benchmark] time until scene and model list are loaded: {now - start_time:.3f} s")
+                break
+        self.window.close()
 
     def _check_changes(self):
         if self._annotation_changed:
@@ -714,28 +1149,236 @@ class AppWindow:
         self.scene_load(self.scenes.scenes_path, self._annotation_scene.scene_num, self._annotation_scene.image_num - 1)
 
 
+_audit_model_cache = dict()  # per worker process cache of model points (obj_id -> Nx3 array in meter)
+
+
+def _audit_model_points(objects_path, obj_id):
+    if obj_id not in _audit_model_cache:
+        _audit_model_cache[obj_id] = np.asarray(load_model_points(objects_path, obj_id).points)
+    return _audit_model_cache[obj_id]
+
+
+def _audit_object(objects_path, obj, model_names, depth_img, cam_K):
+    obj_report = {"obj_id": None, "issues": []}
+    try:
+        obj_id = int(obj['obj_id'])
+        obj_report["obj_id"] = obj_id
+        transform = pose_to_transform(obj)
+        if not np.all(np.isfinite(transform)):
+            raise ValueError("pose contains non finite values")
+    except (KeyError, TypeError, ValueError) as e:
+        obj_report["issues"].append("malformed_pose")
+        obj_report["error"] = str(e)
+        return obj_report, None
+
+    R = transform[0:3, 0:3]
+    rot_error = float(np.abs(np.matmul(R, R.T) - np.identity(3)).max())
+    obj_report["rotation_error"] = rot_error
+    obj_report["rotation_det"] = float(np.linalg.det(R))
+    if rot_error > audit_rot_tol or obj_report["rotation_det"] < 0:
+        obj_report["issues"].append("non_orthonormal_rotation")
+
+    ply_path = os.path.join(objects_path, 'obj_' + f"{obj_id:06}" + '.ply')
+    if not 1 <= obj_id <= len(model_names) or not os.path.exists(ply_path):
+        obj_report["issues"].append("unknown_obj_id")
+        return obj_report, None
+
+    # project model points into the image and keep the front most point per pixel (z-buffer)
+    points = np.matmul(_audit_model_points(objects_path, obj_id), R.T) + transform[0:3, 3]
+    points = points[points[:, 2] > 0]
+    uv = np.matmul(points, cam_K.T)
+    u = np.round(uv[:, 0] / uv[:, 2]).astype(np.int64)
+    v = np.round(uv[:, 1] / uv[:, 2]).astype(np.int64)
+    h, w = depth_img.shape
+    inside = (u >= 0) & (u < w) & (v >= 0) & (v < h)
+    pixel = v[inside] * w + u[inside]
+    z_buffer = np.full(h * w, np.inf)
+    np.minimum.at(z_buffer, pixel, points[inside, 2])
+    obj_pixels = np.flatnonzero(np.isfinite(z_buffer))
+
+    measured = depth_img.reshape(-1)[obj_pixels]
+    valid = measured > 0
+    residual = z_buffer[obj_pixels][valid] - measured[valid]  # negative: object in front of the measured surface
+    occluded = residual > audit_depth_tol
+    visible = residual[~occluded]
+
+    obj_report["projected_pixels"] = int(obj_pixels.size)
+    obj_report["visible_pixels"] = int(visible.size)
+    if visible.size:
+        obj_report["inlier_ratio"] = float(np.mean(np.abs(visible) <= audit_depth_tol))
+        obj_report["free_space_ratio"] = float(np.mean(visible < -audit_depth_tol))
+        obj_report["median_abs_residual"] = float(np.median(np.abs(visible)))
+    else:  # object is outside the image or completely occluded
+        obj_report["inlier_ratio"] = 0.0
+        obj_report["free_space_ratio"] = 0.0
+        obj_report["median_abs_residual"] = None
+
+    if obj_report["inlier_ratio"] < audit_min_inlier_ratio:
+        obj_report["issues"].append("depth_misfit")
+    if obj_report["free_space_ratio"] > audit_max_free_space_ratio:
+        obj_report["issues"].append("floating")
+
+    # model vertices are sparser than the pixels: close the gaps between them and fill the outline
+    silhouette = np.zeros((h, w), dtype=np.uint8)
+    silhouette.reshape(-1)[obj_pixels] = 1
+    if obj_pixels.size:
+        ys, xs = np.divmod(obj_pixels, w)
+        spacing = np.sqrt((np.ptp(xs) + 1) * (np.ptp(ys) + 1) / obj_pixels.size)  # mean vertex spacing in pixel
+        kernel_size = int(np.clip(2 * np.ceil(spacing) + 1, 3, 31))
+        silhouette = cv2.morphologyEx(silhouette, cv2.MORPH_CLOSE, np.ones((kernel_size, kernel_size), np.uint8))
+        contours, _ = cv2.findContours(silhouette, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cv2.drawContours(silhouette, contours, -1, 1, thickness=cv2.FILLED)
+
+    return obj_report, silhouette.astype(bool)
+
+
+def audit_image(task):
+    # scene_gt.json and scene_camera.json are parsed once per scene by audit_dataset, only the depth is read here
+    scenes_path, objects_path, scene_num, image_num, model_names, cam_K, scene_data, error = task
+    report = {"scene_num": scene_num, "image_num": image_num, "objects": [], "issues": []}
+
+    try:
+        if error is not None:
+            raise ValueError(error)
+        depth_img = load_depth_image(scenes_path, scene_num, image_num)
+    except Exception as e:
+        report["issues"].append("unreadable")
+        report["error"] = str(e)
+        report["score"] = 100.0
+        return report
+
+    covered = np.zeros(depth_img.shape, dtype=bool)
+    for obj in scene_data:
+        obj_report, silhouette = _audit_object(objects_path, obj, model_names, depth_img, cam_K)
+        if silhouette is not None:
+            covered |= silhouette
+        report["objects"].append(obj_report)
+        for issue in obj_report["issues"]:
+            if issue not in report["issues"]:
+                report["issues"].append(issue)
+
+    if not scene_data:
+        report["issues"].append("unannotated")
+    # fraction of valid depth pixels inside the filled outline of any annotated object
+    valid_pixels = np.count_nonzero(depth_img > 0)
+    report["coverage"] = float(np.count_nonzero(covered & (depth_img > 0)) / valid_pixels) if valid_pixels else 0.0
+
+    # higher score is worse: unannotated images first, then by number of issues and worst object fit
+    inlier_ratios = [obj["inlier_ratio"] for obj in report["objects"] if "inlier_ratio" in obj]
+    report["score"] = (100.0 * ("unannotated" in report["issues"])
+                       + sum(len(obj["issues"]) for obj in report["objects"])
+                       + 1.0 - min(inlier_ratios, default=1.0))
+    return report
+
+
+def audit_dataset(scenes, output_path, workers=None):
+    model_names = load_model_names(scenes.objects_path)
+
+    tasks = list()
+    for scene_dir in sorted(next(os.walk(scenes.scenes_path))[1]):
+        if not scene_dir.isdigit():
+            continue
+        depth_dir = os.path.join(scenes.scenes_path, scene_dir, 'depth')
+        if not os.path.isdir(depth_dir):
+            continue
+
+        # parse the scene files once, every image task gets its own part
+        scene_gt, scene_camera, scene_error = dict(), dict(), None
+        try:
+            scene_gt_path = os.path.join(scenes.scenes_path, scene_dir, 'scene_gt.json')
+            if os.path.exists(scene_gt_path):
+                with open(scene_gt_path) as f:
+                    scene_gt = json.load(f)
+            with open(os.path.join(scenes.scenes_path, scene_dir, 'scene_camera.json')) as f:
+                scene_camera = json.load(f)
+        except (OSError, ValueError) as e:
+            scene_error = str(e)
+
+        for depth_file in sorted(os.listdir(depth_dir)):
+            if depth_file.endswith('.png') and depth_file[:-4].isdigit():
+                image_num = int(depth_file[:-4])
+                cam_K, error = None, scene_error
+                if error is None:
+                    try:
+                        cam_K = np.array(scene_camera[str(image_num)]['cam_K'], dtype=np.float64).reshape((3, 3))
+                    except (KeyError, TypeError, ValueError) as e:
+                        error = f"no valid cam_K in scene_camera.json: {e}"
+                scene_data = scene_gt.get(str(image_num), list()) if isinstance(scene_gt, dict) else list()
+                if not isinstance(scene_data, list):  # reported per object as malformed pose
+                    scene_data = [scene_data]
+                tasks.append((scenes.scenes_path, scenes.objects_path, int(scene_dir), image_num, model_names,
+                              cam_K, scene_data, error))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        images = list(executor.map(audit_image, tasks, chunksize=max(1, len(tasks) // (8 * (os.cpu_count() or 1)))))
+
+    worst = sorted((image for image in images if image["issues"]), key=lambda image: -image["score"])
+    report = {
+        "scenes_path": scenes.scenes_path,
+        "objects_path": scenes.objects_path,
+        "images_total": len(images),
+        "images_unannotated": sum("unannotated" in image["issues"] for image in images),
+        "images_with_issues": len(worst),
+        "images": images,
+        "worst": [{"scene_num": image["scene_num"], "image_num": image["image_num"], "score": image["score"],
+                   "issues": image["issues"]} for image in worst]
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    # one line per image, worst first, to open directly in the annotation tool
+    worst_path = os.path.splitext(output_path)[0] + '_worst.txt'
+    with open(worst_path, 'w') as f:
+        for image in worst:
+            f.write(f"--start-scene_num {image['scene_num']} --start-image_num {image['image_num']}"
+                    f"  # score {image['score']:.3f}: {', '.join(image['issues'])}\n")
+
+    print(f"[Info] Audited {len(images)} images, {len(worst)} with issues. Report written to {output_path} and {worst_path}")
+    return report
+
+
 def main():
+    start_time = time.perf_counter()
     parser = argparse.ArgumentParser(description="Manual annotation tool for BOP format")
-    parser.add_argument("dataset-path", type=str, help="dataset path")
-    parser.add_argument("dataset-split", type=str,
+    parser.add_argument("dataset_path", metavar="dataset-path", type=str, help="dataset path")
+    parser.add_argument("dataset_split", metavar="dataset-split", type=str,
                         help="dataset split to load (train[_TRAINTYPE], val[_VALTYPE], test[_TESTTYPE])")
     parser.add_argument("--start-scene_num", type=int, help="Scene to start annotation from", default=1)
     parser.add_argument("--start-image_num", type=int, help="Scene to start annotation from", default=0)
+    parser.add_argument("--benchmark-startup", action="store_true",
+                        help="print time to first frame and until everything is loaded, then quit")
+    parser.add_argument("--audit", action="store_true",
+                        help="check annotations of the whole split without opening the gui and write a report")
+    parser.add_argument("--audit-output", type=str, help="audit report path", default="audit_report.json")
+    parser.add_argument("--audit-workers", type=int, help="number of audit processes (default: all cores)",
+                        default=None)
     args = parser.parse_args()
 
     scenes = Dataset(args.dataset_path, args.dataset_split)
+
+    if args.audit:
+        if not (os.path.exists(scenes.scenes_path) and os.path.exists(scenes.objects_path)):
+            print("Could not find scene or object meshes folder")
+            exit(1)
+        audit_dataset(scenes, args.audit_output, args.audit_workers)
+        return
+
     gui.Application.instance.initialize()
     w = AppWindow(2048, 1536, scenes)
 
     if os.path.exists(scenes.scenes_path) and os.path.exists(scenes.objects_path):
-        w.scene_load(scenes.scenes_path, args.start_scene_num, args.start_image_num)
         w.update_obj_list()
+        w.scene_load(scenes.scenes_path, args.start_scene_num, args.start_image_num)
     else:
         w.window.show_message_box("Error",
                                   "Could not find scenes or object meshes folders " + scenes.scenes_path + "/" + scenes.objects_path)
         print("Could not find scene or object meshes folder")
         exit()
 
+    if args.benchmark_startup:
+        w.run_benchmark_startup(start_time)
+        return
+
     # Run the event loop. This will not return until the last window is closed.
     gui.Application.instance.run()
 